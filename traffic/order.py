@@ -1,19 +1,24 @@
 """Prometheus exporter that generates live random fast-food orders."""
 
 from __future__ import annotations
+import bisect
+import heapq
 import time
 import os
 import random
-from collections import defaultdict
-from dataclasses import dataclass
-from typing import Dict, List
+import sys
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
 
-from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from prometheus_client import Counter, Gauge, Histogram, start_http_server, values
 
 # Configuration
 EXPORT_PORT = int(os.getenv("ORDER_METRICS_PORT", "9101"))
+# Skip the per-value mutex in prometheus_client (see UnlockedValue below)
+UNLOCKED_METRICS = os.getenv("ORDER_METRICS_UNLOCKED") == "1"
 
-# Program start timestamp in milliseconds — initialized when main() starts
+# Program start timestamp in monotonic milliseconds — initialized when main() starts
 PROGRAM_START_MS = 0
 
 # Restaurant ambient data ranges
@@ -22,6 +27,7 @@ NOISE_LEVEL_RANGE = (40, 85)  # Decibels
 POWER_USAGE_RANGE = (8000, 12000)  # Watts
 ICE_CREAM_TEMP_RANGE = (-22, -18)  # Celsius
 BATHROOM_CAPACITY = 4  # Number of stalls
+GENDERS = ('M', 'F')  # Bathroom label values
 
 # Convert all times to milliseconds
 PROCESSING_TIMES = {
@@ -34,24 +40,107 @@ MACHINES = {
     "milkshake": 10
 }
 
+# Item names, interned; only used as metric label values
+ITEMS = tuple(sys.intern(item) for item in PROCESSING_TIMES)
+
+# Internally an item is its index into ITEMS, and per-item data lives in
+# tuples and lists at that index rather than in dicts keyed by name
+ITEM_IDS = range(len(ITEMS))
+ITEM_PROCESSING_TIMES = tuple(PROCESSING_TIMES[item] for item in ITEMS)
+ITEM_MACHINES = tuple(MACHINES[item] for item in ITEMS)
+
 ORDERS_PER_INTERVAL = (2, 5)  # Random number of orders generated per interval
 INTERVAL_MS = 10  # Generate orders every 100ms
+AMBIENT_INTERVAL_TICKS = 100  # Update restaurant metrics every 100 ticks (1s)
+
+# Histogram bucket upper bounds in ms, shared by the histograms that use them
+TOTAL_BUCKETS_MS = (100.0, 150.0, 200.0, 250.0, 300.0, 400.0, 500.0, 600.0, 800.0, 1000.0, float("inf"))
+PROCESS_BUCKETS_MS = (100.0, 125.0, 150.0, 175.0, 200.0, 225.0, 250.0, 300.0, 350.0, 400.0, 500.0, float("inf"))
 
-@dataclass
+def monotonic_ms() -> int:
+    """Milliseconds from the monotonic clock, as an int (immune to wall-clock jumps)."""
+    return time.monotonic_ns() // 1_000_000
+
+@dataclass(slots=True)
 class Order:
-    item: str
+    item_id: int  # index into ITEMS
     processing_time: float  # in milliseconds
-    start_time: float  # in milliseconds
-    created_time: float  # in milliseconds
-    queued: bool = True
+    start_time: int  # in monotonic milliseconds
+    created_time: int  # in monotonic milliseconds
+    finish_time: float = field(init=False)  # start_time + processing_time, kept in step by start()
+    
+    def __post_init__(self) -> None:
+        self.finish_time = self.start_time + self.processing_time
+    
+    def start(self, now_ms: int) -> None:
+        self.start_time = now_ms
+        self.finish_time = now_ms + self.processing_time
     
-    @property
-    def is_completed(self) -> bool:
-        return time.time() * 1000 >= self.start_time + self.processing_time
+    def is_completed(self, now_ms: int) -> bool:
+        return now_ms >= self.finish_time
         
-    @property
-    def elapsed_time(self) -> float:
-        return time.time() * 1000 - self.start_time  # keep as milliseconds
+    def elapsed_time(self, now_ms: int) -> int:
+        return now_ms - self.start_time  # keep as milliseconds
+    
+    def __lt__(self, other: Order) -> bool:
+        # Orders in the in-process heap are ordered by when they finish
+        return self.finish_time < other.finish_time
+
+class UnlockedValue:
+    """Drop-in for prometheus_client's MutexValue without the lock.
+
+    Safe here because only the main loop writes metric values; the HTTP server
+    thread only reads them, and reading a float attribute is atomic under the GIL.
+    """
+
+    __slots__ = ("_value", "_exemplar")
+    _multiprocess = False
+
+    def __init__(self, typ, metric_name, name, labelnames, labelvalues, help_text, **kwargs):
+        self._value = 0.0
+        self._exemplar = None
+
+    def inc(self, amount):
+        self._value += amount
+
+    def set(self, value, timestamp=None):
+        self._value = value
+
+    def set_exemplar(self, exemplar):
+        self._exemplar = exemplar
+
+    def get(self):
+        return self._value
+
+    def get_exemplar(self):
+        return self._exemplar
+
+# Must be swapped in before any metric below is created; multiprocess mode is left alone
+if UNLOCKED_METRICS and values.ValueClass is values.MutexValue:
+    values.ValueClass = UnlockedValue
+
+class FastHistogram(Histogram):
+    """Histogram whose observe() finds the bucket by binary search instead of a linear scan."""
+
+    def observe(self, amount: float, exemplar: Optional[Dict[str, str]] = None) -> None:
+        if exemplar:
+            super().observe(amount, exemplar)
+            return
+        self._raise_if_not_observable()
+        self._sum.inc(amount)
+        # Same bucket as the upstream loop: the first upper bound >= amount (+Inf catches the rest)
+        self._buckets[bisect.bisect_left(self._upper_bounds, amount)].inc(1)
+
+    def observe_many(self, amounts: List[float]) -> None:
+        """Observe several amounts with one sum update and one increment per bucket touched."""
+        self._raise_if_not_observable()
+        bucket_counts: Dict[int, int] = {}
+        for amount in amounts:
+            index = bisect.bisect_left(self._upper_bounds, amount)
+            bucket_counts[index] = bucket_counts.get(index, 0) + 1
+        self._sum.inc(sum(amounts))
+        for index, count in bucket_counts.items():
+            self._buckets[index].inc(count)
 
 # Restaurant Environment Metrics
 AMBIENT_TEMP = Gauge(
@@ -112,11 +201,11 @@ AVERAGE_TOTAL_TIME = Gauge(
     "Average total time from order creation to completion (queue + processing) in milliseconds.",
     labelnames=("item",),
 )
-TOTAL_TIME_MS = Histogram(
+TOTAL_TIME_MS = FastHistogram(
     "fastfood_total_time_milliseconds",
     "Total time from order creation to completion (queue + processing) in milliseconds.",
     labelnames=("item",),
-    buckets=(0, 1000, 3000, 5000, 10000, 15000, 30000, float("inf")),  # in ms
+    buckets=TOTAL_BUCKETS_MS,
 )
 P99_TOTAL_TIME = Gauge(
     "fastfood_p99_total_milliseconds",
@@ -128,23 +217,23 @@ P99_PROCESS_TIME = Gauge(
     "99th percentile of processing time in milliseconds",
     labelnames=("item",),
 )
-ORDER_WAIT_MS = Histogram(
+ORDER_WAIT_MS = FastHistogram(
     "fastfood_order_wait_milliseconds",
     "Queue wait time before a machine picks an order (in milliseconds).",
     labelnames=("item",),
-    buckets=(0, 1000, 3000, 5000, 10000, 15000, 30000, float("inf")),  # in ms
+    buckets=TOTAL_BUCKETS_MS,
 )
-ORDER_PROCESS_MS = Histogram(
+ORDER_PROCESS_MS = FastHistogram(
     "fastfood_order_processing_milliseconds",
     "Processing duration from start to finish (in milliseconds).",
     labelnames=("item",),
-    buckets=(8000, 10000, 12000, 15000, 17000, 18000, 19000, 20000, 22000, 25000, 30000, 35000, 40000, 45000, float("inf")),  # in ms
+    buckets=PROCESS_BUCKETS_MS,
 )
-PROCESS_TIME_SLIDING_MS = Histogram(
+PROCESS_TIME_SLIDING_MS = FastHistogram(
     "fastfood_process_time_sliding_milliseconds",
     "Processing time in sliding window for percentile calculation (in milliseconds).",
     labelnames=("item",),
-    buckets=(8000, 10000, 12000, 15000, 17000, 18000, 19000, 20000, 22000, 25000, 30000, 35000, 40000, 45000, float("inf")),  # in ms
+    buckets=PROCESS_BUCKETS_MS,
 )
 SLOW_ORDERS = Counter(
     "fastfood_slow_orders_total",
@@ -176,13 +265,50 @@ SLOW_ORDER_PERCENTAGE = Gauge(
     labelnames=("item",),
 )
 
-def update_restaurant_metrics():
+# Per-item children bound once at startup (indexed by item id) so the hot loop
+# skips the labels() lookup
+_ORDER_COUNT = tuple(ORDER_COUNT.labels(item=item) for item in ITEMS)
+_ORDER_PROCESS_MS = tuple(ORDER_PROCESS_MS.labels(item=item) for item in ITEMS)
+_PROCESS_TIME_SLIDING_MS = tuple(PROCESS_TIME_SLIDING_MS.labels(item=item) for item in ITEMS)
+_TOTAL_TIME_MS = tuple(TOTAL_TIME_MS.labels(item=item) for item in ITEMS)
+_SLOW_ORDERS = tuple(SLOW_ORDERS.labels(item=item) for item in ITEMS)
+_QUEUED_ORDERS = tuple(QUEUED_ORDERS.labels(item=item) for item in ITEMS)
+_BUSY_MACHINES = tuple(BUSY_MACHINES.labels(item=item) for item in ITEMS)
+_AVERAGE_PROCESS_TIME = tuple(AVERAGE_PROCESS_TIME.labels(item=item) for item in ITEMS)
+_P99_PROCESS_TIME = tuple(P99_PROCESS_TIME.labels(item=item) for item in ITEMS)
+_AVERAGE_TOTAL_TIME = tuple(AVERAGE_TOTAL_TIME.labels(item=item) for item in ITEMS)
+_P99_TOTAL_TIME = tuple(P99_TOTAL_TIME.labels(item=item) for item in ITEMS)
+_SLOW_ORDER_PERCENTAGE = tuple(SLOW_ORDER_PERCENTAGE.labels(item=item) for item in ITEMS)
+
+# Per-gender bathroom children, bound the same way
+_BATHROOM_OCCUPANCY = {gender: BATHROOM_OCCUPANCY.labels(gender=gender) for gender in GENDERS}
+_BATHROOM_QUEUE = {gender: BATHROOM_QUEUE.labels(gender=gender) for gender in GENDERS}
+_BATHROOM_VISITS = {gender: BATHROOM_VISITS.labels(gender=gender) for gender in GENDERS}
+_HAND_WASHING = {gender: HAND_WASHING.labels(gender=gender) for gender in GENDERS}
+
+def _p99(values: List[float]) -> float:
+    """Return sorted(values)[int(len(values) * 0.99)] without sorting the whole list."""
+    # That index is the k-th largest value, and k is 1 until there are over 100 samples
+    k = len(values) - int(len(values) * 0.99)
+    if k == 1:
+        return max(values)
+    return heapq.nlargest(k, values)[-1]
+
+@dataclass(slots=True)
+class AmbientState:
+    """Last values written to the restaurant gauges, so updates never read them back."""
+    temperature: float = 22.0  # Default start temp
+    power: float = 10000  # Default start power
+    ice_cream_temp: float = -20  # Default start temp
+    occupancy: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(GENDERS, 0))
+    queue: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(GENDERS, 0))
+
+def update_restaurant_metrics(state: AmbientState):
     """Update various restaurant environmental and facility metrics."""
     # Temperature varies slowly, add small random changes
-    current_temp = AMBIENT_TEMP._value or 22.0  # Default start temp
     temp_change = random.uniform(-0.5, 0.5)
-    new_temp = max(TEMPERATURE_RANGE[0], min(TEMPERATURE_RANGE[1], current_temp + temp_change))
-    AMBIENT_TEMP.set(new_temp)
+    state.temperature = max(TEMPERATURE_RANGE[0], min(TEMPERATURE_RANGE[1], state.temperature + temp_change))
+    AMBIENT_TEMP.set(state.temperature)
     
     # Noise level varies more dramatically with customer activity
     noise = random.uniform(*NOISE_LEVEL_RANGE)
@@ -191,223 +317,221 @@ def update_restaurant_metrics():
     NOISE_LEVEL.set(noise)
     
     # Power usage fluctuates with equipment activity
-    current_power = POWER_USAGE._value or 10000  # Default start power
     power_change = random.uniform(-500, 500)
     if random.random() < 0.05:  # 5% chance of power spike
         power_change += 2000
-    new_power = max(POWER_USAGE_RANGE[0], min(POWER_USAGE_RANGE[1], current_power + power_change))
-    POWER_USAGE.set(new_power)
+    state.power = max(POWER_USAGE_RANGE[0], min(POWER_USAGE_RANGE[1], state.power + power_change))
+    POWER_USAGE.set(state.power)
     
     # Ice cream machine temperature
-    current_ice_temp = ICE_CREAM_TEMP._value or -20  # Default start temp
     temp_drift = random.uniform(-0.2, 0.2)
     if random.random() < 0.01:  # 1% chance of defrost cycle
         temp_drift += 2
-    new_ice_temp = max(ICE_CREAM_TEMP_RANGE[0], min(ICE_CREAM_TEMP_RANGE[1], current_ice_temp + temp_drift))
-    ICE_CREAM_TEMP.set(new_ice_temp)
+    state.ice_cream_temp = max(ICE_CREAM_TEMP_RANGE[0], min(ICE_CREAM_TEMP_RANGE[1], state.ice_cream_temp + temp_drift))
+    ICE_CREAM_TEMP.set(state.ice_cream_temp)
     
     # Bathroom metrics
-    for gender in ['M', 'F']:
+    for gender in GENDERS:
         # Update occupancy (some people leave, new people enter)
-        current_occupancy = BATHROOM_OCCUPANCY.labels(gender=gender)._value or 0
         occupancy_change = random.randint(-1, 1)
         if random.random() < 0.3:  # 30% chance of additional movement
             occupancy_change += random.randint(-1, 1)
-        new_occupancy = max(0, min(BATHROOM_CAPACITY, int(current_occupancy + occupancy_change)))
-        BATHROOM_OCCUPANCY.labels(gender=gender).set(new_occupancy)
+        new_occupancy = max(0, min(BATHROOM_CAPACITY, state.occupancy[gender] + occupancy_change))
+        state.occupancy[gender] = new_occupancy
+        _BATHROOM_OCCUPANCY[gender].set(new_occupancy)
         
         # Update queue based on occupancy
-        current_queue = BATHROOM_QUEUE.labels(gender=gender)._value or 0
         if new_occupancy >= BATHROOM_CAPACITY:
             queue_change = random.randint(0, 2)  # Queue grows when full
         else:
             queue_change = random.randint(-1, 0)  # Queue shrinks when space available
-        new_queue = max(0, int(current_queue + queue_change))
-        BATHROOM_QUEUE.labels(gender=gender).set(new_queue)
+        new_queue = max(0, state.queue[gender] + queue_change)
+        state.queue[gender] = new_queue
+        _BATHROOM_QUEUE[gender].set(new_queue)
         
         # Count visits
         if occupancy_change > 0:
-            BATHROOM_VISITS.labels(gender=gender).inc(occupancy_change)
+            _BATHROOM_VISITS[gender].inc(occupancy_change)
             # 80% chance of hand washing for each new visitor
             for _ in range(occupancy_change):
                 if random.random() < 0.8:
-                    HAND_WASHING.labels(gender=gender).inc()
+                    _HAND_WASHING[gender].inc()
 
 class OrderSimulator:
     def __init__(self):
-        self.active_orders: List[Order] = []
+        # Orders waiting for a machine and orders being processed, per item.
+        # Each active list is a heap, so the next order to finish is always at [0].
+        self.queued: List[Deque[Order]] = [deque() for _ in ITEMS]
+        self.active: List[List[Order]] = [[] for _ in ITEMS]
         self.total_orders: int = 0
-        self.busy_machines: Dict[str, int] = defaultdict(int)
-        self.processing_times: Dict[str, List[tuple[float, float]]] = defaultdict(list)
+        self.busy_machines: List[int] = [0] * len(ITEMS)
+        self.processing_times: List[Deque[tuple[int, int]]] = [deque() for _ in ITEMS]
+        # Running sum of each processing_times window, updated as entries come and go
+        self.processing_time_sums: List[int] = [0] * len(ITEMS)
         self.faulty_machine: bool = False
-        self.start_time: float = time.time() * 1000  # Start time in milliseconds
-    
-    def _start_processing(self, order: Order) -> bool:
-        if not order.queued:
-            return False
-            
-        item = order.item
-        if self.busy_machines[item] >= MACHINES[item]:
-            return False
-            
-        order.queued = False
-        order.start_time = time.time() * 1000  # Convert to milliseconds
-            
-        self.busy_machines[item] += 1
-        return True
+        self.start_time: int = monotonic_ms()  # Start time in milliseconds
+        # Flipped once main() has been running for 100 seconds; never flips back
+        self.spike_allowed: bool = False
     
-    def generate_orders(self):
+    def generate_orders(self, now_ms: int):
         num_orders = random.randint(*ORDERS_PER_INTERVAL)
-        current_time = time.time() * 1000  # Convert to milliseconds
+        items = random.choices(ITEM_IDS, k=num_orders)
+        # 5% chance of having a +180ms processing time, but only after main() has
+        # been running for at least 100 seconds. Use PROGRAM_START_MS as the
+        # universal program start timestamp (in milliseconds).
+        if not self.spike_allowed and PROGRAM_START_MS:
+            self.spike_allowed = now_ms - PROGRAM_START_MS >= 100_000
+        spike_allowed = self.spike_allowed
         
-        for _ in range(num_orders):
-            item = random.choice(["fries", "milkshake"])
-            # 5% chance of having a +180ms processing time, but only after main() has
-            # been running for at least 60 seconds. Use PROGRAM_START_MS as the
-            # universal program start timestamp (in milliseconds).
-            program_running_ms = (time.time() * 1000 - PROGRAM_START_MS) if PROGRAM_START_MS else 0
-            if program_running_ms >= 100_000 and random.random() < 0.05:
-                proc_time = random.uniform(*PROCESSING_TIMES[item]) + 180
-            else:
-                proc_time = random.uniform(*PROCESSING_TIMES[item])
+        # Local aliases skip the module attribute lookups inside the per-order loop
+        chance, uniform = random.random, random.uniform
+        for item_id in items:
+            spike = spike_allowed and chance() < 0.05
+            low, high = ITEM_PROCESSING_TIMES[item_id]
+            proc_time = uniform(low, high) + (180 if spike else 0)
             
             order = Order(
-                item=item,
+                item_id=item_id,
                 processing_time=proc_time,
-                start_time=current_time,
-                created_time=current_time
+                start_time=now_ms,
+                created_time=now_ms
             )
             
-            self.active_orders.append(order)
-            self.total_orders += 1
-            ORDER_COUNT.labels(item=item).inc()
-            
-    def update_metrics(self):
-        # Process queued orders if machines are available
-        for order in self.active_orders:
-            if order.queued:
-                self._start_processing(order)
-        
-        # Handle completed orders
-        completed_orders = []
-        for order in self.active_orders:
-            if order.is_completed:
-                completed_orders.append(order)
-                if not order.queued:
-                    self.busy_machines[order.item] -= 1
-                    process_time = order.elapsed_time
-                    total_time = time.time() * 1000 - order.created_time
-                    
-                    # Record processing time in both histograms
-                    ORDER_PROCESS_MS.labels(item=order.item).observe(process_time)
-                    PROCESS_TIME_SLIDING_MS.labels(item=order.item).observe(process_time)
-                    TOTAL_TIME_MS.labels(item=order.item).observe(total_time)
-                    
-                    # Track slow orders (over 400ms processing time)
-                    if total_time > 400:
-                        SLOW_ORDERS.labels(item=order.item).inc()
-                    
-                    # Keep track of recent processing times (last 20 seconds)
-                    current_time = time.time() * 1000
-                    self.processing_times[order.item].append((current_time, process_time))
-                    # Remove times older than 10 seconds (10000ms)
-                    self.processing_times[order.item] = [
-                        (t, p) for t, p in self.processing_times[order.item] 
-                        if current_time - t <= 2000
-                    ]
-                
-        for order in completed_orders:
-            self.active_orders.remove(order)
+            self.queued[item_id].append(order)
         
-        # Update metrics
+        # One counter update per item per tick rather than one per order;
+        # list.count() tallies the drawn items in C instead of in the loop
+        self.total_orders += num_orders
+        for item_id in ITEM_IDS:
+            count = items.count(item_id)
+            if count:
+                _ORDER_COUNT[item_id].inc(count)
+            
+    def update_metrics(self, now_ms: int):
+        heappush, heappop = heapq.heappush, heapq.heappop
         TOTAL_ORDERS.set(self.total_orders)
-        current_time = time.time() * 1000
         
-        for item in PROCESSING_TIMES:
-            # Count queued orders
-            queued = sum(1 for o in self.active_orders if o.item == item and o.queued)
-            QUEUED_ORDERS.labels(item=item).set(queued)
+        # Running totals across all item types, gathered while each item is handled below
+        overall_process_sum = overall_process_count = 0
+        overall_total_sum = overall_total_count = 0
+        
+        for item_id in ITEM_IDS:
+            # Hand queued orders to free machines, first come first served
+            queue = self.queued[item_id]
+            active = self.active[item_id]
+            admitted = min(ITEM_MACHINES[item_id] - self.busy_machines[item_id], len(queue))
+            for _ in range(admitted):
+                order = queue.popleft()
+                order.start(now_ms)
+                heappush(active, order)
+            self.busy_machines[item_id] += admitted
             
-            # Count busy machines
-            BUSY_MACHINES.labels(item=item).set(self.busy_machines[item])
+            # Handle completed orders, popping them off the heap in finish order
+            window = self.processing_times[item_id]
+            window_sum = self.processing_time_sums[item_id]
+            done_process_times: List[int] = []
+            done_total_times: List[int] = []
+            while active and active[0].is_completed(now_ms):
+                order = heappop(active)
+                process_time = order.elapsed_time(now_ms)
+                done_process_times.append(process_time)
+                done_total_times.append(now_ms - order.created_time)
+                
+                # Keep track of recent processing times (last 2 seconds)
+                window.append((now_ms, process_time))
+                window_sum += process_time
             
-            # Get processing times for active orders
-            active_process_times = [o.elapsed_time for o in self.active_orders 
-                                  if o.item == item and not o.queued]
-            recent_process_times = [p for t, p in self.processing_times[item] 
-                                  if current_time - t <= 100]  # 20 second window
+            # Record this tick's completions in one batch per metric
+            if done_process_times:
+                self.busy_machines[item_id] -= len(done_process_times)
+                _ORDER_PROCESS_MS[item_id].observe_many(done_process_times)
+                _PROCESS_TIME_SLIDING_MS[item_id].observe_many(done_process_times)
+                _TOTAL_TIME_MS[item_id].observe_many(done_total_times)
+                
+                # Track slow orders (over 400ms processing time)
+                slow_orders = sum(1 for t in done_total_times if t > 400)
+                if slow_orders:
+                    _SLOW_ORDERS[item_id].inc(slow_orders)
+            
+            # Entries are appended in time order, so expired ones sit at the head
+            while window and now_ms - window[0][0] > 2000:
+                window_sum -= window.popleft()[1]
+            self.processing_time_sums[item_id] = window_sum
+            
+            # One pass over in-process orders collects both processing times and
+            # total times (queue + processing)
+            all_process_times: List[int] = []
+            all_total_times: List[int] = []
+            for order in active:
+                all_process_times.append(now_ms - order.start_time)
+                all_total_times.append(now_ms - order.created_time)
             
-            # Get total times (queue + processing) for all orders
-            active_total_times = [time.time() * 1000 - o.created_time 
-                                for o in self.active_orders if o.item == item]
+            # Queued orders walk out once they have waited as long as their processing
+            # time; the same pass collects total times for the rest
+            still_queued: Deque[Order] = deque()
+            for order in queue:
+                if not order.is_completed(now_ms):
+                    still_queued.append(order)
+                    all_total_times.append(now_ms - order.created_time)
+            self.queued[item_id] = still_queued
             
-            # Combine active and recent times
-            all_process_times = active_process_times + recent_process_times
+            # Count queued orders and busy machines
+            _QUEUED_ORDERS[item_id].set(len(still_queued))
+            _BUSY_MACHINES[item_id].set(self.busy_machines[item_id])
             
-            # Get all active and completed times
-            all_process_times = active_process_times + recent_process_times
-            all_total_times = active_total_times
+            # The overall averages add the whole 2 second window of completed orders
+            # to the in-process times
+            overall_process_sum += sum(all_process_times) + window_sum
+            overall_process_count += len(all_process_times) + len(window)
+            
+            # Per item, add only those completed in the last 100ms, read from the
+            # newest end of the window
+            for t, p in reversed(window):
+                if now_ms - t > 100:
+                    break
+                all_process_times.append(p)
+            
+            total_sum = sum(all_total_times)
+            overall_total_sum += total_sum
+            overall_total_count += len(all_total_times)
             
             # Calculate metrics if we have data
             if all_process_times or all_total_times:
-                # Calculate metrics for processing times
+                # Average, p99 and slow percentage for processing times, all read
+                # from one sort (the slow count is a binary search for 300ms)
                 if all_process_times:
-                    avg_process_time = sum(all_process_times) / len(all_process_times)
-                    AVERAGE_PROCESS_TIME.labels(item=item).set(avg_process_time)
-                    
-                    sorted_process = sorted(all_process_times)
-                    if len(sorted_process) > 1:  # Need at least 2 samples for p99
-                        p99_process_index = int(len(sorted_process) * 0.99)
-                        p99_process = sorted_process[p99_process_index]
-                        P99_PROCESS_TIME.labels(item=item).set(p99_process)
+                    all_process_times.sort()
+                    count = len(all_process_times)
+                    _AVERAGE_PROCESS_TIME[item_id].set(sum(all_process_times) / count)
+                    if count > 1:  # Need at least 2 samples for p99
+                        _P99_PROCESS_TIME[item_id].set(all_process_times[int(count * 0.99)])
+                    slow_count = count - bisect.bisect_right(all_process_times, 300)
+                    _SLOW_ORDER_PERCENTAGE[item_id].set(slow_count / count * 100)
                 
-                # Calculate metrics for total times
+                # Average and p99 for total times
                 if all_total_times:
-                    avg_total = sum(all_total_times) / len(all_total_times)
-                    AVERAGE_TOTAL_TIME.labels(item=item).set(avg_total)
-                    
-                    sorted_total = sorted(all_total_times)
-                    if len(sorted_total) > 1:  # Need at least 2 samples for p99
-                        p99_total_index = int(len(sorted_total) * 0.99)
-                        p99_total = sorted_total[p99_total_index]
-                        P99_TOTAL_TIME.labels(item=item).set(p99_total)
-                
-                # Calculate percentage of slow orders based on processing times
-                if all_process_times:
-                    slow_count = sum(1 for t in all_process_times if t > 300)
-                    slow_percentage = (slow_count / len(all_process_times)) * 100
-                    SLOW_ORDER_PERCENTAGE.labels(item=item).set(slow_percentage)
+                    count = len(all_total_times)
+                    _AVERAGE_TOTAL_TIME[item_id].set(total_sum / count)
+                    if count > 1:  # Need at least 2 samples for p99
+                        _P99_TOTAL_TIME[item_id].set(_p99(all_total_times))
                 
             else:
                 # Reset all metrics when no data is available
-                AVERAGE_PROCESS_TIME.labels(item=item).set(0)
-                P99_PROCESS_TIME.labels(item=item).set(0)
-                AVERAGE_TOTAL_TIME.labels(item=item).set(0)
-                P99_TOTAL_TIME.labels(item=item).set(0)
-                SLOW_ORDER_PERCENTAGE.labels(item=item).set(0)
-        
-        # Calculate overall averages across all types
-        # For processing time
-        all_active_process_times = [o.elapsed_time for o in self.active_orders if not o.queued]
-        all_recent_process_times = []
-        for item in PROCESSING_TIMES:
-            all_recent_process_times.extend([p for t, p in self.processing_times[item] 
-                                          if current_time - t <= 2000])
-        
-        # For total time (queue + processing)
-        all_total_times = [time.time() * 1000 - o.created_time 
-                          for o in self.active_orders]  # Include all orders
+                _AVERAGE_PROCESS_TIME[item_id].set(0)
+                _P99_PROCESS_TIME[item_id].set(0)
+                _AVERAGE_TOTAL_TIME[item_id].set(0)
+                _P99_TOTAL_TIME[item_id].set(0)
+                _SLOW_ORDER_PERCENTAGE[item_id].set(0)
         
-        # Calculate and set overall averages
-        all_processing_times = all_active_process_times + all_recent_process_times
-        if all_processing_times:
-            overall_process_avg = sum(all_processing_times) / len(all_processing_times)
+        # Calculate and set overall averages across all types
+        if overall_process_count:
+            overall_process_avg = overall_process_sum / overall_process_count
             OVERALL_AVERAGE_PROCESS_TIME.set(overall_process_avg)
         else:
             OVERALL_AVERAGE_PROCESS_TIME.set(0)
             
-        if all_total_times:
-            overall_total_avg = sum(all_total_times) / len(all_total_times)
+        if overall_total_count:
+            overall_total_avg = overall_total_sum / overall_total_count
             OVERALL_AVERAGE_TOTAL_TIME.set(overall_total_avg)
         else:
             OVERALL_AVERAGE_TOTAL_TIME.set(0)
@@ -417,20 +541,34 @@ def main() -> None:
     # Initialize the global program start timestamp so other parts of the
     # program can check how long main has been running.
     global PROGRAM_START_MS
-    PROGRAM_START_MS = time.time() * 1000
+    PROGRAM_START_MS = monotonic_ms()
 
     simulator = OrderSimulator()
+    ambient = AmbientState()
     
     start_http_server(EXPORT_PORT)
     print(f"Order metrics exporter listening on port {EXPORT_PORT}")
     print("Press Ctrl+C to exit")
 
     try:
+        next_tick_ms = monotonic_ms()
+        tick = 0
         while True:
-            simulator.generate_orders()
-            simulator.update_metrics()
-            update_restaurant_metrics()  # Update our fun random metrics
-            time.sleep(INTERVAL_MS / 1000)  # Convert ms to seconds for sleep
+            now_ms = monotonic_ms()  # One clock read per tick
+            simulator.generate_orders(now_ms)
+            simulator.update_metrics(now_ms)
+            # Ambient metrics don't need 100Hz updates; once per scrape-ish interval is plenty
+            if tick % AMBIENT_INTERVAL_TICKS == 0:
+                update_restaurant_metrics(ambient)  # Update our fun random metrics
+            tick += 1
+            
+            # Sleep until the next deadline so a slow tick doesn't delay every later one
+            next_tick_ms += INTERVAL_MS
+            delay_ms = next_tick_ms - monotonic_ms()
+            if delay_ms > 0:
+                time.sleep(delay_ms / 1000)  # Convert ms to seconds for sleep
+            else:
+                next_tick_ms = monotonic_ms()  # Fell behind; restart the schedule from now
     except KeyboardInterrupt:
         print("\nOrder metrics exporter exiting.")
 